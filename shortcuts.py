@@ -15,6 +15,8 @@ import struct
 import sys
 import time
 
+from array import array
+from collections import deque
 from optparse import OptionParser
 
 
@@ -28,15 +30,19 @@ parser.add_option('-o', '--output', action='store', type='string',
 parser.add_option('-p', '--pidfile', action='store', type='string',
                   help='pidfile, also kills old instance if existed')
 parser.add_option('-D', '--daemonize', action='store_true',
-                  help='close files and daemonizes. requires -c')
+                  help='detach stdin and daemonize')
 parser.add_option('-n', '--dry_run', action='store_true',
                   help='Do not actually inject events')
 parser.add_option('-g', '--grab', action='store_true',
                   help='Grab input e.g. won\'t be sent to remarkable, useful for record')
 parser.add_option('--record', action='store_true',
                   help='record input to stdout (debug)')
+parser.add_option('--record-raw', action='store_true',
+                  help='record raw input events to stdout (debug)')
 parser.add_option('--replay', action='store_true',
                   help='replay stdin (debug)')
+parser.add_option('--replay-raw', action='store_true',
+                  help='replay raw input events from stdin (debug)')
 parser.add_option('--replay-action', action='store', type='string',
                   help='replay given action (debug)')
 parser.add_option('--no-sleep', action='store_true',
@@ -49,15 +55,14 @@ if (options.pidfile and options.pidfile.endswith('.pid')
         and '..' not in options.pidfile):
     try:
         with open(options.pidfile, 'r') as pidfile:
-            oldpid = pidfile.read().strip()
-            with open('/proc/%s/cmdline' % oldpid, 'r') as cmdline:
-                if __file__ in cmdline.read():
-                    os.kill(int(oldpid), 15)
-    except EnvironmentError as err:
-        if err.errno == errno.ENOENT:
-            pass
-        else:
-            raise
+            oldpid = int(pidfile.read())
+        # /proc/pid/exe is python itself, look for our script in cmdline
+        with open(f'/proc/{oldpid}/cmdline', 'rb') as cmdline:
+            if os.fsencode(__file__) in cmdline.read():
+                os.kill(oldpid, 15)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        # no or bad pidfile, or old instance already gone
+        pass
 else:
     options.pidfile = None
 
@@ -75,6 +80,9 @@ Stands for: long int, long int, unsigned short, unsigned short, unsigned int
 """
 FORMAT = 'llHHi'
 
+# _IOW('E', 0x90, int)
+EVIOCGRAB = 0x40044590
+
 # input codes for multitouch
 ABS_MT_SLOT = 47
 ABS_MT_TOUCH_MAJOR = 48
@@ -85,6 +93,9 @@ ABS_MT_POSITION_Y = 54
 ABS_MT_TRACKING_ID = 57
 ABS_MT_PRESSURE = 58
 
+# number of multitouch slots tracked up front, grown if device reports more
+MAX_SLOTS = 16
+
 CODES = {
     0: "sync",
     ABS_MT_SLOT: "slot",
@@ -97,11 +108,67 @@ CODES = {
     ABS_MT_PRESSURE: "pressure",
 }
 
-EVENT_SIZE = struct.calcsize(FORMAT)
+# (replay key, code) in the order fields are written for a finger
+FINGER_FIELDS = (
+    ('id', ABS_MT_TRACKING_ID),
+    ('x', ABS_MT_POSITION_X),
+    ('y', ABS_MT_POSITION_Y),
+    ('pressure', ABS_MT_PRESSURE),
+    ('orientation', ABS_MT_ORIENTATION),
+    ('touch_minor', ABS_MT_TOUCH_MINOR),
+    ('touch_major', ABS_MT_TOUCH_MAJOR),
+)
+
+EVENT = struct.Struct(FORMAT)
+EVENT_SIZE = EVENT.size
+# read up to that many events per syscall
+READ_SIZE = EVENT_SIZE * 64
 DEBUG = options.verbose
 DRY_RUN = options.dry_run
 NO_SLEEP = options.no_sleep
 RECORD = options.record
+RECORD_RAW = options.record_raw
+
+
+# --record output, only flushed when waiting for input
+if RECORD:
+    record_out = open(sys.stdout.fileno(), 'wb', buffering=65536, closefd=False)
+else:
+    record_out = None
+
+def dump_record(sec, slots):
+    """
+    write one json line [sec, {slot: {key: value, ...}, ...}] for slots,
+    an iterable of (slot, ((key, value), ...)). Records always have that
+    shape with int values, so format directly instead of building dicts
+    for json.dumps.
+    """
+    fingers = ', '.join(
+        f'"{slot}": {{' + ', '.join(f'"{key}": {value}' for (key, value) in diff) + '}'
+        for (slot, diff) in slots)
+    record_out.write(f'[{sec!r}, {{{fingers}}}]\n'.encode())
+
+
+def noop(*_args, **_kwargs):
+    pass
+
+
+# -v messages, resolved once instead of checking DEBUG at each call site
+log = print if DEBUG >= 1 else noop
+
+if options.daemonize:
+    # detach stdin, and make sure fds 0-2 are all open before opening the
+    # device so it cannot end up on one of them. stdout/stderr are kept
+    # for logs
+    devnull = os.open('/dev/null', os.O_RDWR)
+    os.dup2(devnull, 0)
+    for fd in (1, 2):
+        try:
+            os.fstat(fd)
+        except OSError:
+            os.dup2(devnull, fd)
+    if devnull > 2:
+        os.close(devnull)
 
 # open file in binary mode
 in_file = os.open(infile_path, os.O_RDWR)
@@ -111,23 +178,19 @@ else:
     out_file = in_file
 
 def grab():
-    retries = 10
-    while retries > 0:
+    for _ in range(10):
         try:
-            # grab device, this is EVIOCGRAB
-            fcntl.ioctl(in_file, 0x40044590, 1)
-            break
-        except IOError:
+            fcntl.ioctl(in_file, EVIOCGRAB, 1)
+            return
+        except OSError as err:
             # device busy? XXX kill old and try again?
-            # continue for now
-            if retries <= 1:
-                print("Could not grab, aborting", file=sys.stderr)
-                sys.exit(1)
-        retries -= 1
+            # only retry on that for now
+            if err.errno != errno.EBUSY:
+                raise
         time.sleep(0.2)
+    print("Could not grab, aborting", file=sys.stderr)
+    sys.exit(1)
 
-def to_sec(sec, usec):
-    return sec + usec / 1000000
 
 def frange(start, stop, step):
     """
@@ -212,147 +275,224 @@ def gen_event(descr):
 
 
 
-def replay(source):
+def encode(source):
     """
-    Replay events from source (one json per line or list of 'records')
+    Convert records from source (one json per line or list of 'records')
+    to (timestamp, bytes, record) bursts of packed input events ending with
+    sync, record being kept for -vv traces.
     Record is a triplet:
      - timestamp (fractional sec)
      - dict with {slot_id: {updated field[s]}}, where fields are
         - id/x/y/pressure/orientation/touch_minor/touch_major
     """
-
-    def wev(sec, usec, t, c, v):
-        if DEBUG == 3:
-            print(f"{sec}.{usec:06}: Replay type {t} code {c}, value {v}",
-                  file=sys.stderr)
-        if not DRY_RUN:
-            os.write(out_file, struct.pack(FORMAT, sec, usec, t, c, v))
-
-    def finger(sec, usec, diff):
-        if 'id' in diff:
-            wev(sec, usec, 3, ABS_MT_TRACKING_ID, diff['id'])
-        if 'x' in diff:
-            wev(sec, usec, 3, ABS_MT_POSITION_X, diff['x'])
-        if 'y' in diff:
-            wev(sec, usec, 3, ABS_MT_POSITION_Y, diff['y'])
-        if 'pressure' in diff:
-            wev(sec, usec, 3, ABS_MT_PRESSURE, diff['pressure'])
-        if 'orientation' in diff:
-            wev(sec, usec, 3, ABS_MT_ORIENTATION, diff['orientation'])
-        if 'touch_minor' in diff:
-            wev(sec, usec, 3, ABS_MT_TOUCH_MINOR, diff['touch_minor'])
-        if 'touch_major' in diff:
-            wev(sec, usec, 3, ABS_MT_TOUCH_MAJOR, diff['touch_major'])
-
-    tstart = time.time()
-    tfirst = -1
+    pack_into = EVENT.pack_into
+    loads = json.loads
+    fields = FINGER_FIELDS
+    # events are packed in place, grown if a record needs more room
+    buf = bytearray(EVENT_SIZE * 32)
+    view = memoryview(buf)
     cur_slot = 0
 
+    def pack_finger(pos, tv_sec, tv_usec, diff):
+        for (key, code) in fields:
+            value = diff.get(key)
+            if value is not None:
+                pack_into(buf, pos, tv_sec, tv_usec, 3, code, value)
+                pos += EVENT_SIZE
+        return pos
+
     for record in source:
         if isinstance(record, str):
-            record = json.loads(record)
+            record = loads(record)
         (sec, detail) = record
-        if tfirst == -1:
-            tfirst = sec
-        if DEBUG == 2:
-            print(f"Replay {record}", file=sys.stderr)
 
-        delay = sec - tfirst + tstart - time.time()
-        if delay > 0 and not NO_SLEEP:
-            time.sleep(delay)
+        # at most slot switch and all fields per finger, then sync
+        size = EVENT_SIZE * (len(detail) * (len(fields) + 1) + 1)
+        if size > len(buf):
+            view.release()
+            buf.extend(bytes(size - len(buf)))
+            view = memoryview(buf)
 
-        tv_sec = int(sec)
-        tv_usec = int((sec - tv_sec) * 1000000)
+        (tv_sec, tv_usec) = divmod(round(sec * 1000000), 1000000)
+        pos = 0
+        # current slot first, saves switching away and back
         last_slot = cur_slot
-        if last_slot in detail:
-            finger(tv_sec, tv_usec, detail[last_slot])
-        for slot in detail:
+        diff = detail.get(last_slot)
+        if diff is not None:
+            pos = pack_finger(pos, tv_sec, tv_usec, diff)
+        for (slot, diff) in detail.items():
             if slot == last_slot:
                 continue
-            wev(tv_sec, tv_usec, 3, ABS_MT_SLOT, int(slot))
+            pack_into(buf, pos, tv_sec, tv_usec, 3, ABS_MT_SLOT, int(slot))
+            pos += EVENT_SIZE
             cur_slot = slot
-            finger(tv_sec, tv_usec, detail[slot])
-        wev(tv_sec, tv_usec, 0, 0, 0)
+            pos = pack_finger(pos, tv_sec, tv_usec, diff)
+        pack_into(buf, pos, tv_sec, tv_usec, 0, 0, 0)
+        pos += EVENT_SIZE
+        yield (sec, bytes(view[:pos]), record)
+
+
+def split_raw(data):
+    """
+    Split raw input events as written by --record-raw into
+    (timestamp, bytes, None) bursts ending with sync
+    """
+    start = 0
+    end = len(data) - len(data) % EVENT_SIZE
+    pos = 0
+    for (sec, usec, t, c, _) in EVENT.iter_unpack(memoryview(data)[:end]):
+        pos += EVENT_SIZE
+        if t != 0 or c != 0:
+            continue
+        yield (sec + usec * 1e-6, data[start:pos], None)
+        start = pos
+
+
+def play(bursts):
+    """
+    Write (timestamp, bytes, record) bursts to output, one write per burst,
+    paced according to timestamps unless NO_SLEEP
+    """
+    write = os.write
+    sleep = time.sleep
+    monotonic = time.monotonic
+    fd = out_file
+    pace = not NO_SLEEP
+    trace_records = DEBUG == 2
+    trace = DEBUG == 3
+    dry_run = DRY_RUN
+    # monotonic() - sec, set on first burst
+    offset = None
+
+    for (sec, burst, record) in bursts:
+        if pace:
+            if offset is None:
+                offset = monotonic() - sec
+            delay = sec + offset - monotonic()
+            if delay > 0:
+                sleep(delay)
+
+        if trace_records and record is not None:
+            print(f"Replay {record}", file=sys.stderr)
+        if trace:
+            for (ev_sec, ev_usec, t, c, v) in EVENT.iter_unpack(burst):
+                print(f"{ev_sec}.{ev_usec:06}: Replay type {t} code {c}, value {v}",
+                      file=sys.stderr)
+        if not dry_run:
+            write(fd, burst)
+
+
+def replay(source):
+    """
+    Replay events from source, see encode()
+    """
+    play(encode(source))
+
+
+def replay_raw(data):
+    """
+    Replay raw input events as written by --record-raw
+    """
+    play(split_raw(data))
 
 
 if options.grab:
     grab()
 
 if options.daemonize:
-    if not options.command:
-        print("Cannot daemonize if no command!", file=sys.stderr)
-        sys.exit(1)
-    devnull = open('/dev/null', 'w+')
-    #sys.stdout = devnull
-    #sys.stderr = devnull
-    sys.stdin.close()
-    if os.fork() != 0:
-        sys.exit(0)
+    # single fork is enough as we never open a tty after setsid
     if os.fork() != 0:
-        sys.exit(0)
+        os._exit(0)
+    os.setsid()
 
 if options.pidfile:
     with open(options.pidfile, 'w') as pidfile:
         pidfile.write("%d\n" % os.getpid())
 
 
-def point(finger, sec):
-    point = dict(sec=sec)
-    if finger.x != -1:
-        point['x'] = finger.x
-    if finger.y != -1:
-        point['y'] = finger.y
-    if finger.pressure != -1:
-        point['pressure'] = finger.pressure
-    if finger.orientation != -1:
-        point['orientation'] = finger.orientation
-    if finger.touch_minor != -1:
-        point['touch_minor'] = finger.touch_minor
-    if finger.touch_major != -1:
-        point['touch_major'] = finger.touch_major
-    return point
+# trace point layout, also index of the matching Finger.trace column,
+# unset fields are -1
+POINT_USEC = 0
+POINT_X = 1
+POINT_Y = 2
+POINT_TOUCH_MAJOR = 6
+NO_POINT = (-1, -1, -1, -1, -1, -1, -1)
+# replay keys of point fields after usec
+POINT_KEYS = tuple(key for (key, _) in FINGER_FIELDS[1:])
+# record diff for a released finger
+RELEASED_DIFF = (('id', -1),)
+
+
+def point(finger, usec):
+    """
+    (usec, x, y, pressure, orientation, touch_minor, touch_major) tuple,
+    usec being the integer timestamp in microseconds and the other fields
+    in FINGER_FIELDS order
+    """
+    return (usec, finger.x, finger.y, finger.pressure, finger.orientation,
+            finger.touch_minor, finger.touch_major)
 
 
 class Finger():
-    x = -1
-    y = -1
-    pressure = -1
-    orientation = -1
-    touch_minor = -1
-    touch_major = -1
-    # valid after release
-    up_sec = -1
-    down_duration = -1
-
-    def __init__(self, tracking_id, sec, usec):
+    __slots__ = ('id', 'down_usec', 'trace', 'x', 'y', 'pressure',
+                 'orientation', 'touch_minor', 'touch_major',
+                 'up_usec', 'down_duration', 'last')
+    # input code -> attribute set by update()
+    ATTRS = {
+        ABS_MT_POSITION_X: 'x',
+        ABS_MT_POSITION_Y: 'y',
+        ABS_MT_PRESSURE: 'pressure',
+        ABS_MT_ORIENTATION: 'orientation',
+        ABS_MT_TOUCH_MINOR: 'touch_minor',
+        ABS_MT_TOUCH_MAJOR: 'touch_major',
+    }
+
+    def __init__(self, tracking_id, tv_sec, tv_usec):
         self.id = tracking_id
-        self.down_sec = to_sec(sec, usec)
-        self.trace = []
+        # timestamps and durations are integer microseconds
+        self.down_usec = tv_sec * 1000000 + tv_usec
+        # one column per point field, see point()
+        self.trace = (array('q'), array('i'), array('i'), array('i'),
+                      array('i'), array('i'), array('i'))
+        self.x = -1
+        self.y = -1
+        self.pressure = -1
+        self.orientation = -1
+        self.touch_minor = -1
+        self.touch_major = -1
+        # valid after release
+        self.up_usec = -1
+        self.down_duration = -1
+        # last committed point, same as point_at(-1)
+        self.last = NO_POINT
 
     def update(self, code, value):
-        if code == ABS_MT_POSITION_X:
-            self.x = value
-        elif code == ABS_MT_POSITION_Y:
-            self.y = value
-        elif code == ABS_MT_PRESSURE:
-            self.pressure = value
-        elif code == ABS_MT_ORIENTATION:
-            self.orientation = value
-        elif code == ABS_MT_TOUCH_MINOR:
-            self.touch_minor = value
-        elif code == ABS_MT_TOUCH_MAJOR:
-            self.touch_major = value
-        else:
+        attr = self.ATTRS.get(code)
+        if attr is None:
             return False
+        setattr(self, attr, value)
         return True
 
-    def commit(self, sec):
-        self.trace.append(point(self, sec))
+    def commit(self, usec):
+        self.last = point(self, usec)
+        for (column, value) in zip(self.trace, self.last):
+            column.append(value)
 
-    # return touch duration in msec
-    def release(self, sec):
-        self.up_sec = sec
-        self.down_duration = (self.up_sec - self.down_sec)
+    def point_at(self, index):
+        return tuple(column[index] for column in self.trace)
+
+    def release(self, usec):
+        self.up_usec = usec
+        self.down_duration = (self.up_usec - self.down_usec)
+
+
+def in_area(finger, feature):
+    """
+    check finger position is within feature's precomputed 'area'
+    (x_min, y_min, x_max, y_max) bounds
+    """
+    (x_min, y_min, x_max, y_max) = feature['area']
+    return x_min <= finger.x <= x_max and y_min <= finger.y <= y_max
 
 
 def detect_double_tap(tracking, feature):
@@ -361,17 +501,13 @@ def detect_double_tap(tracking, feature):
     prev = tracking.prev
     cur = tracking.cur
 
-    # ignore large touches (likely palm of hand)
-    if any(point.get('touch_major', 0) > 30 for point in cur.trace):
-        return False
-    if any(point.get('touch_major', 0) > 30 for point in prev.trace):
-        return False
+    # cheap checks on last state first, traces are only scanned last
 
     # total time with prev and current touch < 1s
-    if cur.up_sec - prev.down_sec > 1:
+    if cur.up_usec - prev.down_usec > 1000000:
         return False
     # prev and current touch < 0.5s
-    if prev.down_duration > 0.5 or cur.down_duration > 0.5:
+    if prev.down_duration > 500000 or cur.down_duration > 500000:
         return False
     # prev and current touch area is small enough
     # for simplicity we only consider the last position
@@ -379,17 +515,13 @@ def detect_double_tap(tracking, feature):
         return False
 
     # check for min/max edges... Only check last position again.
-    if cur.x < feature.get('x_min', 0):
-        return False
-    if cur.y < feature.get('y_min', 0):
-        return False
-    if cur.x > feature.get('x_max', 1500):
-        return False
-    if cur.y > feature.get('y_max', 1900):
+    if not in_area(cur, feature):
         return False
 
-    # okay!
-    return True
+    # ignore large touches (likely palm of hand)
+    if max(cur.trace[POINT_TOUCH_MAJOR], default=-1) > 30:
+        return False
+    return max(prev.trace[POINT_TOUCH_MAJOR], default=-1) <= 30
 
 def detect_line(tracking, feature):
     cur = tracking.cur
@@ -398,14 +530,16 @@ def detect_line(tracking, feature):
     # - length > min length
     # - angle within min/max angle
     # note our angle is between -180 and 180
-    try:
-        (dx, dy) = (cur.x - cur.trace[0]['x'], cur.y - cur.trace[0]['y'])
-    except KeyError as key:
+    if not cur.trace[POINT_USEC]:
+        return False
+    (first_x, first_y) = (cur.trace[POINT_X][0], cur.trace[POINT_Y][0])
+    if first_x == -1 or first_y == -1:
         if DEBUG > 1:
             # apparently happens when we write to fd
-            print(f"first trace missing {key} ?! {cur.id}: {cur.trace[0]}",
+            print(f"first trace missing x/y ?! {cur.id}: {cur.point_at(0)}",
                   file=sys.stderr)
         return False
+    (dx, dy) = (cur.x - first_x, cur.y - first_y)
     length = math.sqrt(dx*dx + dy*dy)
     if length < feature.get('min_length', 50):
         return False
@@ -430,23 +564,13 @@ def detect_line(tracking, feature):
         return False
 
     # swipe duration
-    if cur.down_duration > feature.get('duration_max', 3000):
+    if cur.down_duration > feature.get('duration_max', 3000) * 1000000:
         return False
-    if cur.down_duration < feature.get('duration_min', 0):
+    if cur.down_duration < feature.get('duration_min', 0) * 1000000:
         return False
 
     # check for min/max edges... Only check last position again.
-    if cur.x < feature.get('x_min', 0):
-        return False
-    if cur.y < feature.get('y_min', 0):
-        return False
-    if cur.x > feature.get('x_max', 1500):
-        return False
-    if cur.y > feature.get('y_max', 1900):
-        return False
-
-    # okay!
-    return True
+    return in_area(cur, feature)
 
 
 DETECT = {
@@ -454,10 +578,24 @@ DETECT = {
     'line': detect_line,
 }
 
+def action_events(feature):
+    """
+    packed events for feature's action, generated on first use and kept
+    in feature as they never change
+    """
+    events = feature.get('events')
+    if events is None:
+        events = feature['events'] = tuple(encode(gen_event(feature['action'])))
+    return events
+
+
 class Tracking():
-    prev = None
-    cur = None
-    active = True
+    __slots__ = ('prev', 'cur', 'active')
+
+    def __init__(self):
+        self.prev = None
+        self.cur = None
+        self.active = True
 
     def update(self, finger):
         self.cur = finger
@@ -481,17 +619,13 @@ class Tracking():
                 FEATURES.pop(i)
                 continue
             if found:
-                if DEBUG >= 1:
-                    print(f"Detected {feature.get('name')}",
-                          file=sys.stderr)
+                log(f"Detected {feature.get('name')}", file=sys.stderr)
                 if 'action' in feature:
-                    return gen_event(feature['action'])
+                    return action_events(feature)
                 match feature.get('special'):
                     case 'toggle':
                         self.active = not self.active
-                        if DEBUG >= 1:
-                            print(f'New active: {self.active}',
-                                  file=sys.stderr)
+                        log(f'New active: {self.active}', file=sys.stderr)
                     case special:
                         print(f"Feature {feature.get('name')} had no action/unknown special {special}",
                               file=sys.stderr)
@@ -503,74 +637,85 @@ class Tracking():
 
 
 class State():
-    fingers = {}
-    slot_id = 0
-    finger = None
-    last_side = None
-    actions = []
-    # batch per sync event
-    updated = {}
-    released = {}
-
-    def update(self, tv_sec, tv_usec, code, value):
-        if code == ABS_MT_SLOT:
-            self.slot_id = value
-            self.finger = self.fingers.get(value)
-            if self.finger:
-                self.updated[value] = self.finger
-            return
-        if code == ABS_MT_TRACKING_ID and value >= 0:
+    __slots__ = ('fingers', 'slot_id', 'finger', 'actions', 'updated',
+                 'released')
+
+    def __init__(self):
+        # indexed by slot id, None when no finger down in that slot
+        self.fingers = [None] * MAX_SLOTS
+        self.slot_id = 0
+        self.finger = None
+        self.actions = deque()
+        # batch per sync event
+        self.updated = {}
+        self.released = {}
+
+    def on_slot(self, _tv_sec, _tv_usec, _code, value):
+        self.slot_id = value
+        if value >= len(self.fingers):
+            self.fingers.extend([None] * (value + 1 - len(self.fingers)))
+        self.finger = self.fingers[value]
+        if self.finger:
+            self.updated[value] = self.finger
+
+    def on_tracking_id(self, tv_sec, tv_usec, code, value):
+        if value >= 0:
             self.finger = Finger(value, tv_sec, tv_usec)
             self.fingers[self.slot_id] = self.finger
             self.updated[self.slot_id] = self.finger
             return
 
-        if code == 0:
-            sec = to_sec(tv_sec, tv_usec)
-            if RECORD:
-                if self.released:
-                    print(json.dumps([sec,
-                                      {slot_id: {"id": -1} for slot_id in self.released}]))
-                recorded = {}
-                for slot, finger in self.updated.items():
-                    diff = {}
-                    prev = finger.trace[-1] if finger.trace else {}
-                    if not prev:
-                        diff['id'] = finger.id
-                    if finger.x != prev.get('x', -1):
-                        diff['x'] = finger.x
-                    if finger.y != prev.get('y', -1):
-                        diff['y'] = finger.y
-                    if finger.pressure != prev.get('pressure', -1):
-                        diff['pressure'] = finger.pressure
-                    if finger.orientation != prev.get('orientation', -1):
-                        diff['orientation'] = finger.orientation
-                    if finger.touch_minor != prev.get('touch_minor', -1):
-                        diff['touch_minor'] = finger.touch_minor
-                    if finger.touch_major != prev.get('touch_major', -1):
-                        diff['touch_major'] = finger.touch_major
-                    recorded[slot]=diff
-                if recorded:
-                    print(json.dumps([sec, recorded]))
-            for (slot_id, finger) in self.released.items():
-                finger.release(sec)
-                if DEBUG == 2:
-                    print(f"{tv_sec}.{tv_usec:06}: {finger.id} up {finger.x},{finger.y} after {finger.down_duration}. Pressure {finger.pressure} Orientation {finger.orientation}",
-                          file=sys.stderr)
-                # trigger events on release for now
-                if not RECORD:
-                    action = tracking.update(finger)
-                    if action:
-                        state.actions.append(action)
-            for finger in self.updated.values():
-                finger.commit(sec)
-                if DEBUG == 2:
-                    print(f"{tv_sec}.{tv_usec:06}: {finger.id} pressed {finger.x},{finger.y}. Pressure {finger.pressure} Orientation {finger.orientation}",
-                          file=sys.stderr)
-            self.released = {}
-            self.updated = {}
+        if self.finger is None:
+            print(f"{tv_sec}.{tv_usec:06}: Unhandled touch event without id code {code}, value {value}",
+                  file=sys.stderr)
             return
 
+        self.released[self.slot_id] = self.finger
+        self.finger = None
+        self.fingers[self.slot_id] = None
+
+    def on_sync(self, tv_sec, tv_usec, _code, _value):
+        usec = tv_sec * 1000000 + tv_usec
+        if RECORD:
+            sec = tv_sec + tv_usec / 1000000
+            if self.released:
+                dump_record(sec, [(slot_id, RELEASED_DIFF)
+                                  for slot_id in self.released])
+            recorded = []
+            for slot, finger in self.updated.items():
+                prev = finger.last
+                cur = point(finger, usec)
+                if prev is not NO_POINT and cur[1:] == prev[1:]:
+                    # slot touched but no field changed, skip comparing each
+                    recorded.append((slot, ()))
+                    continue
+                diff = [(key, value)
+                        for (key, value, old) in zip(POINT_KEYS, cur[1:], prev[1:])
+                        if value != old]
+                if prev is NO_POINT:
+                    diff.insert(0, ('id', finger.id))
+                recorded.append((slot, diff))
+            if recorded:
+                dump_record(sec, recorded)
+        for (slot_id, finger) in self.released.items():
+            finger.release(usec)
+            if DEBUG == 2:
+                print(f"{tv_sec}.{tv_usec:06}: {finger.id} up {finger.x},{finger.y} after {finger.down_duration / 1000000}. Pressure {finger.pressure} Orientation {finger.orientation}",
+                      file=sys.stderr)
+            # trigger events on release for now
+            if not RECORD:
+                action = tracking.update(finger)
+                if action:
+                    state.actions.append(action)
+        for finger in self.updated.values():
+            finger.commit(usec)
+            if DEBUG == 2:
+                print(f"{tv_sec}.{tv_usec:06}: {finger.id} pressed {finger.x},{finger.y}. Pressure {finger.pressure} Orientation {finger.orientation}",
+                      file=sys.stderr)
+        self.released.clear()
+        self.updated.clear()
+
+    def on_field(self, tv_sec, tv_usec, code, value):
         if self.finger is None:
             print(f"{tv_sec}.{tv_usec:06}: Unhandled touch event without id code {code}, value {value}",
                   file=sys.stderr)
@@ -578,14 +723,16 @@ class State():
 
         if self.finger.update(code, value):
             self.updated[self.slot_id] = self.finger
-        elif code == ABS_MT_TRACKING_ID:
-            self.released[self.slot_id] = self.finger
-            self.finger = None
-            del self.fingers[self.slot_id]
-        else:
-            if DEBUG == 1:
-                print(f"{tv_sec}.{tv_usec:06}: Unhandled touch event code {code}, value {value}",
-                      file=sys.stderr)
+        elif DEBUG == 1:
+            print(f"{tv_sec}.{tv_usec:06}: Unhandled touch event code {code}, value {value}",
+                  file=sys.stderr)
+
+    # input code -> handler, anything else is a finger field
+    HANDLERS = {
+        ABS_MT_SLOT: on_slot,
+        ABS_MT_TRACKING_ID: on_tracking_id,
+        0: on_sync,
+    }
 
 
 ACTIONS = {
@@ -687,10 +834,25 @@ FEATURES = [
     },
 ]
 
+def set_areas(features):
+    """
+    features never change, precompute area bounds once for in_area()
+    """
+    for feature in features:
+        feature['area'] = (feature.get('x_min', 0), feature.get('y_min', 0),
+                           feature.get('x_max', 1500), feature.get('y_max', 1900))
+
+
+set_areas(FEATURES)
+
 if options.replay:
     replay(sys.stdin)
     sys.exit(0)
 
+if options.replay_raw:
+    replay_raw(sys.stdin.buffer.read())
+    sys.exit(0)
+
 if options.replay_action:
     if options.replay_action not in ACTIONS:
         print(f"action {options.replay_action} not found",
@@ -702,57 +864,109 @@ if options.replay_action:
 tracking = Tracking()
 state = State()
 
-def parse(tv_sec, tv_usec, evtype, code, value):
+# handler lookup bound once as default arguments, parse runs for every event
+def parse(tv_sec, tv_usec, evtype, code, value,
+          handler=State.HANDLERS.get, on_field=State.on_field):
     if DEBUG == 3:
         print(f"{tv_sec}.{tv_usec:06}: Event type {evtype} code {CODES.get(code, 'unknown')} ({code}), value {value}",
               file=sys.stderr)
 
-    if evtype == 0 and code == 0 and value == 0:
-        pass
-    elif evtype != 3:
-        print(f"{tv_sec}.{tv_usec:06}: Unhandled key type {evtype} code {code}, value {value}",
-              file=sys.stderr)
+    # EV_ABS first, it is most events; then EV_SYN SYN_REPORT
+    if evtype == 3 or (evtype == 0 and code == 0 and value == 0):
+        handler(code, on_field)(state, tv_sec, tv_usec, code, value)
         return
 
-    state.update(tv_sec, tv_usec, code, value)
+    print(f"{tv_sec}.{tv_usec:06}: Unhandled key type {evtype} code {code}, value {value}",
+          file=sys.stderr)
+
+
+# reused read buffer, an incomplete event left over from the previous read
+# (pipes in tests can split events) is kept at its start
+read_buf = bytearray(READ_SIZE)
+read_view = memoryview(read_buf)
+partial = 0
+
+
+# registered once, level-triggered as we only read READ_SIZE per wakeup
+poller = select.epoll()
+try:
+    poller.register(in_file, select.EPOLLIN)
+except PermissionError:
+    # epoll refuses regular files (e.g. a --record-raw capture), which are
+    # always ready to read anyway
+    poller.close()
+    poller = None
 
 
 def handle_input():
-    timeout = None
-    # NO_SLEEP actually waits a bit for pipe input
-    if state.actions or NO_SLEEP:
-        timeout = 0.05
-    (ready, _, errors) = select.select([in_file], [], [in_file], timeout)
-    if errors:
-        print("input file in error state!", file=sys.stderr)
-        return False
-    if in_file in ready:
-        event = os.read(in_file, EVENT_SIZE)
-        if len(event) != EVENT_SIZE:
-            print(f"input file had something to read, but no event or bad length {len(event)}",
+    global partial
+    if state.actions or poller is None:
+        # fd is non-blocking: just try to read, replay if nothing is pending
+        ready = True
+    else:
+        if RECORD:
+            record_out.flush()
+        # NO_SLEEP actually waits a bit for pipe input
+        ready = poller.poll(0.05 if NO_SLEEP else -1)
+        if ready and ready[0][1] & select.EPOLLERR:
+            print("input file in error state!", file=sys.stderr)
+            return False
+    if ready:
+        try:
+            size = os.readv(in_file, [read_view[partial:]])
+        except BlockingIOError:
+            if state.actions:
+                log("Replaying one action", file=sys.stderr)
+                play(state.actions.popleft())
+            return True
+        if not size:
+            print(f"input file had something to read, but no event (partial {partial})",
                   file=sys.stderr)
             return False
-        parse(*struct.unpack(FORMAT, event))
-    elif state.actions:
-        if DEBUG >= 1:
-            print("Replaying one action", file=sys.stderr)
-        replay(state.actions.pop(0))
+        if RECORD_RAW:
+            os.write(sys.stdout.fileno(), read_view[:size])
+            return True
+        size += partial
+        end = size - size % EVENT_SIZE
+        # locals for the per-event loop
+        parse_event = parse
+        for event in EVENT.iter_unpack(read_view[:end]):
+            parse_event(*event)
+        partial = size - end
+        read_buf[:partial] = read_view[end:size]
     elif NO_SLEEP:
         return False
     return True
 
 
-# wait for input to start
-if NO_SLEEP:
-    select.select([in_file], [], [])
+def drive():
+    """
+    handle input until it ends, then replay any action left
+    """
+    handle = handle_input
+    while handle():
+        pass
 
-while handle_input():
-    pass
+    actions = state.actions
+    pop = actions.popleft
+    while actions:
+        play(pop())
+
+
+# never block in read, poller tells us when to read
+os.set_blocking(in_file, False)
+
+# wait for input to start
+if NO_SLEEP and poller:
+    poller.poll()
 
-while state.actions:
-    replay(state.actions.pop(0))
+drive()
 
 # unreachable...
+if RECORD:
+    record_out.flush()
+if poller:
+    poller.close()
 if out_file != in_file:
     os.close(out_file)
 os.close(in_file)
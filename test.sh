@@ -62,4 +62,8 @@ run_generated double_tap_left --record \
 		| rgrep left run --replay --\
 	|| error "replay of recording of synthetic left didn't recognize left"
 
+run_generated double_tap_left --record-raw \
+		| rgrep left run --replay-raw --\
+	|| error "raw replay of raw recording of synthetic left didn't recognize left"
+
 [ "$FAILED" = 0 ]